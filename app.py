@@ -1,18 +1,73 @@
+import collections
+import io
 import os
-from typing import List, Dict, Tuple
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Iterator, List, Dict, Tuple
 import streamlit as st
-from openai import OpenAI
+import tiktoken
+
+if TYPE_CHECKING:
+    from openai import OpenAI
+
+# Context window sizes for the supported models
+MODEL_CTX = {
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+}
+
+# Widget option lists, hoisted so reruns reuse the same immutable objects
+_MODELS = ("gpt-4", "gpt-3.5-turbo")
+_LEVELS = ("Beginner", "Intermediate", "Advanced")
+_ENGINES = ("Unity", "Unreal", "Godot", "Pygame", "HTML5/Canvas")
+_LANGUAGES = ("C#", "C++", "GDScript", "Python", "JavaScript")
+_TRACKS = ("2D", "3D", "Mobile", "Multiplayer", "AI/Gameplay", "Audio", "UI/UX")
+_MODES = ("Tutor", "Coach", "Code Reviewer", "Curriculum Planner")
+_STARTERS = (
+    "Give me a beginner roadmap for making a 2D platformer.",
+    "Explain the game loop and update vs. fixed update in simple terms.",
+    "Write a simple player movement script and explain each line.",
+    "How do I structure a small game project folder?",
+    "Help me pick the right engine for my goals.",
+    "Design a small practice project for this week.",
+)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str) -> "tiktoken.Encoding":
+    return tiktoken.encoding_for_model(model)
 
 # -----------------------------
 # State Management
 # -----------------------------
+# Hard cap on retained history; old turns are evicted automatically so
+# long-running sessions can't grow per-session memory without bound
+HISTORY_MAXLEN = 200
+
+
 def init_state():
     if "messages" not in st.session_state:
-        st.session_state.messages = []
+        st.session_state.messages = collections.deque(maxlen=HISTORY_MAXLEN)
     if "settings" not in st.session_state:
         st.session_state.settings = default_settings()
-    if "client" not in st.session_state:
-        st.session_state.client = OpenAI()
+
+
+@st.cache_resource
+def get_openai_client() -> "OpenAI":
+    # Imported lazily so Streamlit's first paint isn't blocked by the heavy
+    # openai/httpx import chain on cold start. Shared across sessions so the
+    # underlying httpx pool reuses connections; HTTP/2 multiplexes concurrent
+    # users' requests over one TCP connection
+    import httpx
+    from openai import OpenAI
+
+    return OpenAI(
+        http_client=httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(60.0, connect=5.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=32),
+        )
+    )
 
 
 def default_settings() -> Dict:
@@ -33,19 +88,20 @@ def default_settings() -> Dict:
 # -----------------------------
 def render_sidebar() -> Dict:
     st.sidebar.header("Tutor Settings")
-    model = st.sidebar.selectbox("Model", options=["gpt-4", "gpt-3.5-turbo"], index=0)
-    level = st.sidebar.selectbox("Your Level", options=["Beginner", "Intermediate", "Advanced"], index=0)
-    engine = st.sidebar.selectbox("Game Engine", options=["Unity", "Unreal", "Godot", "Pygame", "HTML5/Canvas"], index=0)
-    language = st.sidebar.selectbox("Primary Language", options=["C#", "C++", "GDScript", "Python", "JavaScript"], index=0)
-    track = st.sidebar.selectbox("Focus Area", options=["2D", "3D", "Mobile", "Multiplayer", "AI/Gameplay", "Audio", "UI/UX"], index=0)
-    mode = st.sidebar.selectbox("Teaching Mode", options=["Tutor", "Coach", "Code Reviewer", "Curriculum Planner"], index=0)
+    model = st.sidebar.selectbox("Model", options=_MODELS, index=0)
+    level = st.sidebar.selectbox("Your Level", options=_LEVELS, index=0)
+    engine = st.sidebar.selectbox("Game Engine", options=_ENGINES, index=0)
+    language = st.sidebar.selectbox("Primary Language", options=_LANGUAGES, index=0)
+    track = st.sidebar.selectbox("Focus Area", options=_TRACKS, index=0)
+    mode = st.sidebar.selectbox("Teaching Mode", options=_MODES, index=0)
     temperature = st.sidebar.slider("Creativity (temperature)", 0.0, 1.5, 0.4, 0.1)
     max_tokens = st.sidebar.slider("Max tokens per reply", 256, 4096, 1200, 64)
 
     col1, col2 = st.sidebar.columns(2)
     with col1:
         if st.button("New Chat"):
-            st.session_state.messages = []
+            st.session_state.messages.clear()
+            st.session_state.pop("export_cache", None)
             st.toast("Started a new chat.")
     with col2:
         if st.button("Insert Starter Plan"):
@@ -53,7 +109,16 @@ def render_sidebar() -> Dict:
                 {"role": "user", "content": "Create a 4-week learning plan for me to start making small games."}
             )
     if st.sidebar.button("Export Chat"):
-        export_text = export_chat(st.session_state.messages)
+        # Key on length plus the identity of the last message: length alone
+        # goes stale once the deque saturates at HISTORY_MAXLEN (len is
+        # pinned) or when a cleared chat grows back to the same length
+        msgs = st.session_state.messages
+        key = (len(msgs), id(msgs[-1]) if msgs else None)
+        cached = st.session_state.get("export_cache")
+        if cached is None or cached[0] != key:
+            cached = (key, export_chat(msgs))
+            st.session_state.export_cache = cached
+        export_text = cached[1]
         st.sidebar.download_button(
             label="Download .md",
             data=export_text,
@@ -83,15 +148,7 @@ def render_header():
 def render_quick_starters():
     st.write("Quick starters:")
     cols = st.columns(3)
-    starters = [
-        "Give me a beginner roadmap for making a 2D platformer.",
-        "Explain the game loop and update vs. fixed update in simple terms.",
-        "Write a simple player movement script and explain each line.",
-        "How do I structure a small game project folder?",
-        "Help me pick the right engine for my goals.",
-        "Design a small practice project for this week.",
-    ]
-    for i, text in enumerate(starters):
+    for i, text in enumerate(_STARTERS):
         if cols[i % 3].button(text, key=f"starter_{i}"):
             st.session_state.messages.append({"role": "user", "content": text})
 
@@ -99,32 +156,55 @@ def render_quick_starters():
 # -----------------------------
 # Prompt Crafting
 # -----------------------------
+_SYS_TEMPLATE = (
+    "You are GameDev Mentor, an expert {engine} and general game development tutor. "
+    "User profile: Level={level}, Focus={track}, Preferred Language={language}. "
+    "Teaching Mode={mode}.\n\n"
+    "Goals:\n"
+    "- Teach practical game development with clear steps.\n"
+    "- Tailor examples to {engine} using {language} when applicable.\n"
+    "- Provide runnable mini-examples and bite-sized exercises.\n"
+    "- Encourage learning by building small prototypes before full games.\n"
+    "- Offer brief definitions of key terms and suggest next steps.\n\n"
+    "Guidelines:\n"
+    "- Be concise but thorough; prefer short sections and lists.\n"
+    "- When code is requested, include minimal complete snippets.\n"
+    "- If ambiguous, ask a clarifying question first.\n"
+    "- For Unity use C#; for Unreal use C++ or describe Blueprints; for Godot use GDScript; for Pygame use Python; for HTML5 use JavaScript.\n"
+    "- Include lightweight exercises and optional extensions when appropriate.\n"
+    "- Avoid proprietary or unsafe content. If a full game is requested, provide a minimal prototype and an implementation plan.\n"
+    "- Use markdown headings and code blocks for readability."
+)
+
+
+@st.cache_data(max_entries=32)
 def craft_system_prompt(settings: Dict) -> str:
-    return (
-        f"You are GameDev Mentor, an expert {settings['engine']} and general game development tutor. "
-        f"User profile: Level={settings['level']}, Focus={settings['track']}, Preferred Language={settings['language']}. "
-        f"Teaching Mode={settings['mode']}.\n\n"
-        f"Goals:\n"
-        f"- Teach practical game development with clear steps.\n"
-        f"- Tailor examples to {settings['engine']} using {settings['language']} when applicable.\n"
-        f"- Provide runnable mini-examples and bite-sized exercises.\n"
-        f"- Encourage learning by building small prototypes before full games.\n"
-        f"- Offer brief definitions of key terms and suggest next steps.\n\n"
-        f"Guidelines:\n"
-        f"- Be concise but thorough; prefer short sections and lists.\n"
-        f"- When code is requested, include minimal complete snippets.\n"
-        f"- If ambiguous, ask a clarifying question first.\n"
-        f"- For Unity use C#; for Unreal use C++ or describe Blueprints; for Godot use GDScript; for Pygame use Python; for HTML5 use JavaScript.\n"
-        f"- Include lightweight exercises and optional extensions when appropriate.\n"
-        f"- Avoid proprietary or unsafe content. If a full game is requested, provide a minimal prototype and an implementation plan.\n"
-        f"- Use markdown headings and code blocks for readability."
-    )
-
+    return _SYS_TEMPLATE.format_map(settings)
+
+
+def build_messages(system_prompt: str, history: List[Dict[str, str]], settings: Dict) -> List[Dict[str, str]]:
+    enc = get_encoding(settings["model"])
+    # Leave room for the reply, the system prompt, and a small safety margin
+    budget = MODEL_CTX[settings["model"]] - settings["max_tokens"] - len(enc.encode(system_prompt)) - 512
+
+    tail: List[Dict[str, str]] = []
+    used = 0
+    for i, msg in enumerate(reversed(history)):
+        # Cache the token count on the message; content is immutable once
+        # appended (don't use setdefault here: its default argument would be
+        # evaluated eagerly, re-encoding the message on every call)
+        if "_tok" not in msg:
+            msg["_tok"] = len(enc.encode(msg["content"])) + 4
+        cost = msg["_tok"]
+        # Always keep the newest message, even over budget, so the user's
+        # just-typed input is never silently dropped from the request
+        if i > 0 and used + cost > budget:
+            break
+        used += cost
+        tail.append({"role": msg["role"], "content": msg["content"]})
+    tail.reverse()
 
-def build_messages(system_prompt: str, history: List[Dict[str, str]]) -> List[Dict[str, str]]:
     messages = [{"role": "system", "content": system_prompt}]
-    # Limit context to the last 30 turns to keep prompt size manageable
-    tail = history[-60:]
     messages.extend(tail)
     return messages
 
@@ -132,70 +212,118 @@ def build_messages(system_prompt: str, history: List[Dict[str, str]]) -> List[Di
 # -----------------------------
 # OpenAI Interaction
 # -----------------------------
-def generate_response(client: OpenAI, model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> str:
+def coalesce_stream(deltas: Iterator[str], max_ms: float = 50.0, max_chars: int = 64) -> Iterator[str]:
+    """Batch token deltas so the frontend re-renders every ~50ms instead of
+    once per token; imperceptible to the user, much cheaper to draw."""
+    buf = ""
+    last_flush = time.monotonic()
+    for delta in deltas:
+        buf += delta
+        if len(buf) >= max_chars or time.monotonic() - last_flush > max_ms / 1000:
+            yield buf
+            buf = ""
+            last_flush = time.monotonic()
+    if buf:
+        yield buf
+
+
+def generate_response(client: "OpenAI", model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int) -> Iterator[str]:
     response = client.chat.completions.create(
         model=model,
         messages=messages,
         temperature=temperature,
         max_tokens=max_tokens,
+        stream=True,
     )
-    return response.choices[0].message.content
+    for chunk in response:
+        yield chunk.choices[0].delta.content or ""
 
 
 # -----------------------------
 # Utilities
 # -----------------------------
 def export_chat(history: List[Dict[str, str]]) -> str:
-    out = ["# GameDev Mentor Chat Export\n"]
+    buf = io.StringIO()
+    buf.write("# GameDev Mentor Chat Export\n\n")
     for msg in history:
-        role = msg["role"]
-        out.append(f"## {role.capitalize()}\n")
-        out.append(f"{msg['content']}\n")
-    return "\n".join(out)
+        buf.write(f"## {msg['role'].capitalize()}\n\n{msg['content']}\n\n")
+    return buf.getvalue()
 
 
-def api_key_warning():
+def api_key_warning() -> bool:
     if os.environ.get("OPENAI_API_KEY"):
-        return
+        return True
     st.warning(
         "No OpenAI API key found. Set the OPENAI_API_KEY environment variable before running this app."
     )
+    return False
 
 
 # -----------------------------
 # Main Chat Rendering
 # -----------------------------
-def render_chat(settings: Dict):
+# Messages shown expanded by default; anything older collapses into an
+# expander to keep the DOM and per-rerun payload small
+RECENT_MSG_COUNT = 20
+
+
+def _render_message(msg: Dict[str, str]):
+    with st.chat_message(msg["role"]):
+        st.markdown(msg["content"])
+
+
+def _render_history():
+    msgs = list(st.session_state.messages)
+    older, recent = msgs[:-RECENT_MSG_COUNT], msgs[-RECENT_MSG_COUNT:]
+    if older:
+        with st.expander(f"Show {len(older)} older messages"):
+            for msg in older:
+                _render_message(msg)
+    for msg in recent:
+        _render_message(msg)
+
+
+def render_chat(settings: Dict, enabled: bool = True):
     # Display conversation history
-    for msg in st.session_state.messages:
-        with st.chat_message(msg["role"]):
-            st.markdown(msg["content"])
+    _render_history()
 
-    # Input box
-    user_input = st.chat_input("Ask about game development, request examples, or a learning plan...")
+    # Input box; disabled when no API key is configured so we never issue
+    # a request that would only time out
+    user_input = st.chat_input(
+        "Ask about game development, request examples, or a learning plan...",
+        disabled=not enabled,
+    )
     if user_input:
         st.session_state.messages.append({"role": "user", "content": user_input})
         with st.chat_message("user"):
             st.markdown(user_input)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                try:
-                    system_prompt = craft_system_prompt(settings)
-                    api_messages = build_messages(system_prompt, st.session_state.messages)
-                    reply = generate_response(
-                        client=st.session_state.client,
-                        model=settings["model"],
-                        messages=api_messages,
-                        temperature=settings["temperature"],
-                        max_tokens=settings["max_tokens"],
+            # Fail fast rather than constructing a client (which raises
+            # without a key) or waiting out an HTTP timeout
+            if not os.environ.get("OPENAI_API_KEY"):
+                st.error("OPENAI_API_KEY is not set; cannot contact OpenAI.")
+                return
+
+            try:
+                system_prompt = craft_system_prompt(settings)
+                api_messages = build_messages(system_prompt, st.session_state.messages, settings)
+                reply = st.write_stream(
+                    coalesce_stream(
+                        generate_response(
+                            client=get_openai_client(),
+                            model=settings["model"],
+                            messages=api_messages,
+                            temperature=settings["temperature"],
+                            max_tokens=settings["max_tokens"],
+                        )
                     )
-                except Exception as e:
-                    st.error(f"Error generating response: {e}")
-                    return
+                )
+            except Exception as e:
+                st.error(f"Error generating response: {e}")
+                return
 
-                st.markdown(reply)
-                st.session_state.messages.append({"role": "assistant", "content": reply})
+            st.session_state.messages.append({"role": "assistant", "content": reply})
 
 
 # -----------------------------
@@ -204,7 +332,7 @@ def render_chat(settings: Dict):
 def main():
     st.set_page_config(page_title="GameDev Mentor", page_icon="🎮", layout="wide")
     init_state()
-    api_key_warning()
+    has_key = api_key_warning()
     settings = render_sidebar()
     render_header()
 
@@ -212,7 +340,7 @@ def main():
         st.info("Tell me your goals (e.g., 'I want to make a 2D platformer in Unity using C#').")
         render_quick_starters()
 
-    render_chat(settings)
+    render_chat(settings, enabled=has_key)
 
 
 if __name__ == "__main__":